@@ -1,7 +1,10 @@
 from __future__ import annotations
 
-from typing import List, Tuple, Set
+import os
+import json
+from typing import Callable, Dict, Iterable, List, Tuple, Set
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from alibabacloud_cdn20180510.client import Client as Cdn20180510Client
 from alibabacloud_live20161101.client import Client as live20161101Client
@@ -17,7 +20,10 @@ log = logging.getLogger(__name__)
 
 
 class Aliyun:
-    def __init__(self, access_key_id, access_key_secret) -> None:
+    def __init__(self, access_key_id, access_key_secret, cdn_snapshot_file: str | None = None) -> None:
+        # last seen CDN domains with their certificates, used to skip unchanged domains
+        self._cdn_snapshot_file = cdn_snapshot_file
+        self._cdn_snapshot: Dict[str, dict] = {}
         self._cdn_client = Cdn20180510Client(
             open_api_models.Config(
                 access_key_id=access_key_id,
@@ -84,12 +90,7 @@ class Aliyun:
         cert = self.get_cert_by_id(cert_id)
         if not cert:
             raise Exception(f"Failed to get certificate {cert_id}")
-        for d in self._cdn_client.describe_user_domains(
-            cdn_20180510_models.DescribeUserDomainsRequest(
-                page_number=1,
-                page_size=50,
-            ),
-        ).body.domains.page_data:
+        for d in self._iter_cdn_user_domains():
             if d.domain_name == domain_name:
                 self._cdn_client.set_cdn_domain_sslcertificate(
                     cdn_20180510_models.SetCdnDomainSSLCertificateRequest(
@@ -100,6 +101,7 @@ class Aliyun:
                         sslprotocol="on",
                     )
                 )
+                self._forget_cdn_domains([domain_name])
                 return cert, d
         return cert, None
 
@@ -110,12 +112,7 @@ class Aliyun:
         cert = self.get_cert_by_id(cert_id)
         if not cert:
             raise Exception(f"Failed to get certificate {cert_id}")
-        for d in self._live_client.describe_live_user_domains(
-            live_20161101_models.DescribeLiveUserDomainsRequest(
-                page_number=1,
-                page_size=50,
-            )
-        ).body.domains.page_data:
+        for d in self._iter_live_user_domains():
             if d.domain_name == domain_name:
                 self._live_client.set_live_domain_certificate(
                     live_20161101_models.SetLiveDomainCertificateRequest(
@@ -128,6 +125,67 @@ class Aliyun:
                 return cert, d
         return cert, None
 
+    def set_cert_for_cdn_domains(
+        self, cert_id: int, domain_names: List[str], concurrency: int = 10
+    ) -> Tuple[
+        cas_20200407_models.GetUserCertificateDetailResponseBody,
+        Generator[Tuple[str, Exception | None], None, None],
+    ]:
+        cert = self.get_cert_by_id(cert_id)
+        if not cert:
+            raise Exception(f"Failed to get certificate {cert_id}")
+        known_domains = {d.domain_name for d in self._iter_cdn_user_domains()}
+
+        def set_cert(domain_name: str) -> None:
+            if domain_name not in known_domains:
+                raise Exception(f"CDN domain {domain_name} not found")
+            self._cdn_client.set_cdn_domain_sslcertificate(
+                cdn_20180510_models.SetCdnDomainSSLCertificateRequest(
+                    cert_id=cert_id,
+                    cert_type="cas",
+                    cert_name=str(cert.name),
+                    domain_name=domain_name,
+                    sslprotocol="on",
+                )
+            )
+
+        def iter_results() -> Generator[Tuple[str, Exception | None], None, None]:
+            done = []
+            try:
+                for domain_name, error in _run_concurrently(set_cert, domain_names, concurrency):
+                    if not error:
+                        done.append(domain_name)
+                    yield domain_name, error
+            finally:
+                self._forget_cdn_domains(done)
+
+        return cert, iter_results()
+
+    def set_cert_for_live_domains(
+        self, cert_id: int, domain_names: List[str], concurrency: int = 10
+    ) -> Tuple[
+        cas_20200407_models.GetUserCertificateDetailResponseBody,
+        Generator[Tuple[str, Exception | None], None, None],
+    ]:
+        cert = self.get_cert_by_id(cert_id)
+        if not cert:
+            raise Exception(f"Failed to get certificate {cert_id}")
+        known_domains = {d.domain_name for d in self._iter_live_user_domains()}
+
+        def set_cert(domain_name: str) -> None:
+            if domain_name not in known_domains:
+                raise Exception(f"live domain {domain_name} not found")
+            self._live_client.set_live_domain_certificate(
+                live_20161101_models.SetLiveDomainCertificateRequest(
+                    cert_name=str(cert.name),
+                    cert_type="cas",
+                    domain_name=domain_name,
+                    sslprotocol="on",
+                )
+            )
+
+        return cert, _run_concurrently(set_cert, domain_names, concurrency)
+
     def replace_cert_for_all_matching_cdn_domains(self, new_cert_id: int) -> Tuple[
         cas_20200407_models.GetUserCertificateDetailResponseBody | None,
         List[cdn_20180510_models.DescribeUserDomainsResponseBodyDomainsPageData],
@@ -166,6 +224,7 @@ class Aliyun:
                             sslprotocol="on",
                         )
                     )
+                    self._cdn_snapshot.pop(str(d.domain_name), None)
                     replaced_domains.append(d)
                     log.info(f"certificate <{new_cert_id}> set for CDN domain <{d.domain_name}>")
             except Exception as e:
@@ -218,6 +277,46 @@ class Aliyun:
     def delete_cert(self, cert_id: int) -> None:
         self._cas_client.delete_user_certificate(cas_20200407_models.DeleteUserCertificateRequest(cert_id=cert_id))
 
+    def _iter_cdn_user_domains(
+        self,
+    ) -> Generator[cdn_20180510_models.DescribeUserDomainsResponseBodyDomainsPageData, None, None]:
+        # the largest page size accepted by DescribeUserDomains
+        page_size = 500
+        page_number = 1
+        while True:
+            body = self._cdn_client.describe_user_domains(
+                cdn_20180510_models.DescribeUserDomainsRequest(
+                    page_number=page_number,
+                    page_size=page_size,
+                ),
+            ).body
+            page_data = body.domains.page_data if body.domains else None
+            if not page_data:
+                return
+            yield from page_data
+            if page_number * page_size >= (body.total_count or 0):
+                return
+            page_number += 1
+
+    def _iter_live_user_domains(
+        self,
+    ) -> Generator[live_20161101_models.DescribeLiveUserDomainsResponseBodyDomainsPageData, None, None]:
+        page_number = 1
+        while True:
+            body = self._live_client.describe_live_user_domains(
+                live_20161101_models.DescribeLiveUserDomainsRequest(
+                    page_number=page_number,
+                    page_size=50,
+                )
+            ).body
+            page_data = body.domains.page_data if body.domains else None
+            if not page_data:
+                return
+            yield from page_data
+            if page_number * 50 >= (body.total_count or 0):
+                return
+            page_number += 1
+
     def iter_cdn_domains(
         self,
     ) -> Generator[
@@ -228,18 +327,75 @@ class Aliyun:
         None,
         None,
     ]:
-        for d in self._cdn_client.describe_user_domains(
-            cdn_20180510_models.DescribeUserDomainsRequest(
-                page_number=1,
-                page_size=50,
-            ),
-        ).body.domains.page_data:
+        last_snapshot = self._load_cdn_snapshot()
+        self._cdn_snapshot = {}
+        fetched = 0
+        for d in self._iter_cdn_user_domains():
             if d.ssl_protocol == "off":
                 continue
-            certs = self._cdn_client.describe_domain_certificate_info(
-                cdn_20180510_models.DescribeDomainCertificateInfoRequest(domain_name=str(d.domain_name))
-            ).body.cert_infos.cert_info
+            domain_name = str(d.domain_name)
+            last = last_snapshot.get(domain_name)
+            # reused certificate info keeps `status` as of the last fetch, `cert_expire_time` does not
+            # change for the same certificate; domains without a modification time are always fetched
+            if (
+                last
+                and d.gmt_modified
+                and last.get("gmt_modified") == d.gmt_modified
+                and last.get("ssl_protocol") == d.ssl_protocol
+            ):
+                certs = [
+                    cdn_20180510_models.DescribeDomainCertificateInfoResponseBodyCertInfosCertInfo().from_map(c)
+                    for c in last.get("certs", [])
+                ]
+            else:
+                certs = self._cdn_client.describe_domain_certificate_info(
+                    cdn_20180510_models.DescribeDomainCertificateInfoRequest(domain_name=domain_name)
+                ).body.cert_infos.cert_info
+                fetched += 1
+            self._cdn_snapshot[domain_name] = {
+                "gmt_modified": d.gmt_modified,
+                "ssl_protocol": d.ssl_protocol,
+                "certs": [c.to_map() for c in certs],
+            }
             yield d, certs
+        log.debug(f"certificate info fetched for {fetched} of {len(self._cdn_snapshot)} CDN domains")
+        self._save_cdn_snapshot(self._cdn_snapshot)
+
+    def _load_cdn_snapshot(self) -> Dict[str, dict]:
+        if not self._cdn_snapshot_file:
+            return {}
+        try:
+            with open(self._cdn_snapshot_file, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning(f"ignore unreadable CDN snapshot <{self._cdn_snapshot_file}>: {e}")
+            return {}
+        return snapshot if isinstance(snapshot, dict) else {}
+
+    def _save_cdn_snapshot(self, snapshot: Dict[str, dict]) -> None:
+        if not self._cdn_snapshot_file:
+            return
+        try:
+            d = os.path.dirname(self._cdn_snapshot_file)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            tmp_file = self._cdn_snapshot_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, self._cdn_snapshot_file)
+        except OSError as e:
+            log.warning(f"failed to save CDN snapshot <{self._cdn_snapshot_file}>: {e}")
+
+    def _forget_cdn_domains(self, domain_names: Iterable[str]) -> None:
+        # force certificate info of the domains to be fetched again on next scan
+        if not self._cdn_snapshot_file:
+            return
+        snapshot = self._load_cdn_snapshot()
+        forgotten = [snapshot.pop(d, None) for d in domain_names]
+        if any(f is not None for f in forgotten):
+            self._save_cdn_snapshot(snapshot)
 
     def iter_live_domains(
         self,
@@ -251,13 +407,18 @@ class Aliyun:
         None,
         None,
     ]:
-        for d in self._live_client.describe_live_user_domains(
-            live_20161101_models.DescribeLiveUserDomainsRequest(
-                page_number=1,
-                page_size=50,
-            )
-        ).body.domains.page_data:
+        for d in self._iter_live_user_domains():
             certs = self._live_client.describe_live_domain_certificate_info(
                 live_20161101_models.DescribeLiveDomainCertificateInfoRequest(domain_name=str(d.domain_name))
             ).body.cert_infos.cert_info
             yield d, certs
+
+
+def _run_concurrently(
+    fn: Callable[[str], None], items: List[str], concurrency: int
+) -> Generator[Tuple[str, Exception | None], None, None]:
+    # yield (item, error) as soon as each call completes, error is None on success
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fn, i): i for i in items}
+        for f in as_completed(futures):
+            yield futures[f], f.exception()
@@ -1,17 +1,20 @@
-import os, sys
+import os, sys, json
 from pathlib import Path
 from typing import List, TextIO
 import rich_click as click
 from rich.console import Console
 from rich.panel import Panel
+from rich.progress import Progress
 from rich.table import Table
 from rich.console import Group
 from datetime import datetime, timezone
 import logging
 import dateutil.parser
+from click.core import ParameterSource
 from configobj import ConfigObj
 
 from .cert import Aliyun
+from .verify import cert_fingerprint, verify_served_cert
 
 cprint = Console().print
 
@@ -47,10 +50,22 @@ class RenewedDomains(click.ParamType):
     default=str(Path.home() / ".secrets/aliyun.ini"),
     help="Aliyun access key ini file",
 )
+@click.option(
+    "--cdn-snapshot-file",
+    envvar="ALIYUN_CDN_SNAPSHOT_FILE",
+    help="keep CDN domain certificates in this file and only refresh new or modified domains, "
+    "certificate status of unchanged domains is as of their last refresh",
+)
 @click.pass_context
-def cli(ctx, access_key_id: str, access_key_secret: str, access_key_ini_file: str) -> None:
+def cli(
+    ctx,
+    access_key_id: str,
+    access_key_secret: str,
+    access_key_ini_file: str,
+    cdn_snapshot_file: str,
+) -> None:
     if access_key_id and access_key_secret:
-        ctx.obj = Aliyun(access_key_id, access_key_secret)
+        ctx.obj = Aliyun(access_key_id, access_key_secret, cdn_snapshot_file)
     elif access_key_ini_file:
         # read ini file
         config = ConfigObj(access_key_ini_file)
@@ -59,6 +74,7 @@ def cli(ctx, access_key_id: str, access_key_secret: str, access_key_ini_file: st
         ctx.obj = Aliyun(
             config.get("dns_aliyun_key_id"),
             config.get("dns_aliyun_key_secret"),
+            cdn_snapshot_file,
         )
     else:
         raise click.UsageError("access-key-id and access-key-secret or access-key-ini-file is required")
@@ -205,17 +221,61 @@ def delete_cert(aliyun: Aliyun, cert_id: int) -> None:
 
 @cli.command()
 @click.option("--cert-id", required=True, type=int, help="certificate id")
-@click.option("--domain", required=True, type=str, help="domain name")
+@click.option("--domain", type=str, help="domain name")
+@click.option(
+    "--domain-file",
+    type=click.File("r"),
+    help="file of domain names, one per line, use - to read from stdin",
+)
 @click.option(
     "--service",
     type=click.Choice(["cdn", "live"], case_sensitive=False),
     help="aliyun service type",
 )
+@click.option(
+    "--concurrency",
+    default=10,
+    type=click.IntRange(min=1),
+    help="number of domains of --domain-file to set at the same time",
+)
+@click.option(
+    "--output",
+    type=click.Choice(["progress", "jsonl"], case_sensitive=False),
+    default="progress",
+    help="show results of --domain-file as a progress bar or JSON lines",
+)
+@click.option("--verify", is_flag=True, help="verify the domain is serving the certificate over TLS")
+@click.option("--verify-deadline", default=300, type=int, help="seconds to wait for the domain to serve the certificate")
 @pass_aliyun
-def set_cert(aliyun: Aliyun, cert_id: int, domain: str, service: str) -> None:
+def set_cert(
+    aliyun: Aliyun,
+    cert_id: int,
+    domain: str,
+    domain_file: TextIO,
+    service: str,
+    concurrency: int,
+    output: str,
+    verify: bool,
+    verify_deadline: int,
+) -> None:
     """
     set certificate for aliyun domain
     """
+    if bool(domain) == bool(domain_file):
+        raise click.UsageError("please specify either --domain or --domain-file")
+    if service not in ("cdn", "live"):
+        raise click.UsageError("please specify --service cdn or --service live")
+    ctx = click.get_current_context()
+    for option in ("concurrency", "output"):
+        if domain and ctx.get_parameter_source(option) != ParameterSource.DEFAULT:
+            raise click.UsageError(f"--{option} only works with --domain-file")
+    if domain_file:
+        lines = (line.strip() for line in domain_file)
+        domains = list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+        if not domains:
+            raise click.UsageError(f"no domain found in {domain_file.name}")
+        set_cert_for_domains(aliyun, cert_id, domains, service, concurrency, output, verify, verify_deadline)
+        return
     if service == "cdn":
         c, cdn = aliyun.set_cert_for_cdn_domain(cert_id, domain)
         if not c:
@@ -223,32 +283,86 @@ def set_cert(aliyun: Aliyun, cert_id: int, domain: str, service: str) -> None:
         if not cdn:
             raise click.ClickException(f"CDN domain {domain} not found")
         cprint(f"cert [bold green]{cert_id}[/] set for CDN domain [bold green]{cdn.domain_name}[/]")
-    elif service == "live":
+    else:
         c, live = aliyun.set_cert_for_live_domain(cert_id, domain)
         if not c:
             raise click.ClickException(f"certificate {cert_id} not found")
         if not live:
             raise click.ClickException(f"live domain {domain} not found")
         cprint(f"cert [bold green]{cert_id}[/] set for live domain [bold green]{live.domain_name}[/]")
+    if verify and not verify_domains([domain], str(c.cert), verify_deadline):
+        raise click.ClickException(f"domain {domain} is not serving certificate {cert_id}")
+
+
+def set_cert_for_domains(
+    aliyun: Aliyun,
+    cert_id: int,
+    domains: List[str],
+    service: str,
+    concurrency: int,
+    output: str,
+    verify: bool,
+    verify_deadline: int,
+) -> None:
+    if service == "cdn":
+        c, results = aliyun.set_cert_for_cdn_domains(cert_id, domains, concurrency)
     else:
-        raise click.UsageError("please specify --service cdn or --service live")
+        c, results = aliyun.set_cert_for_live_domains(cert_id, domains, concurrency)
+    succeeded = []
+    failed = []
+    if output == "jsonl":
+        # keep stdout machine readable, logs go to stderr
+        sh.setStream(sys.stderr)
+        for d, e in results:
+            (failed if e else succeeded).append(d)
+            click.echo(json.dumps({"stage": "set", "domain": d, "ok": not e, "error": str(e) if e else None}))
+    else:
+        with Progress(console=Console()) as progress:
+            task = progress.add_task(f"setting cert {cert_id}", total=len(domains))
+            for d, e in results:
+                if e:
+                    failed.append(d)
+                    progress.console.print(f"[bold red]{d}[/] failed: {e}")
+                else:
+                    succeeded.append(d)
+                    progress.console.print(f"cert [bold green]{cert_id}[/] set for [bold green]{d}[/]")
+                progress.advance(task)
+    verified = True
+    if verify:
+        verified = verify_domains(succeeded, str(c.cert), verify_deadline, output == "jsonl")
+    summary = f"cert {cert_id} set for {len(succeeded)} of {len(domains)} {service} domains"
+    if failed:
+        summary += f", failed: {' '.join(failed)}"
+    if not verified:
+        summary += f", not all domains are serving certificate {cert_id}"
+    if failed or not verified:
+        raise click.ClickException(summary)
+    click.echo(summary, err=output == "jsonl")
 
 
 @cli.command()
 @click.option("--cert-id", required=True, type=int, help="certificate id")
 @click.option("--cdn", is_flag=True, help="replace certificates of CDN domains")
 @click.option("--live", is_flag=True, help="replace certificates of live domains")
+@click.option("--verify", is_flag=True, help="verify replaced domains are serving the certificate over TLS")
+@click.option("--verify-deadline", default=300, type=int, help="seconds to wait for domains to serve the certificate")
 @pass_aliyun
-def replace_cert(aliyun: Aliyun, cert_id: int, cdn: bool, live: bool) -> None:
+def replace_cert(aliyun: Aliyun, cert_id: int, cdn: bool, live: bool, verify: bool, verify_deadline: int) -> None:
     """
     replace certificate for all domains which using certificate of the same common name
     """
     if not cdn and not live:
         raise click.UsageError("please specify --cdn or --live")
+    cert = None
+    replaced_domains = []
     if cdn:
-        aliyun.replace_cert_for_all_matching_cdn_domains(cert_id)
+        cert, domains, _, _ = aliyun.replace_cert_for_all_matching_cdn_domains(cert_id)
+        replaced_domains.extend(str(d.domain_name) for d in domains)
     if live:
-        aliyun.replace_cert_for_all_matching_live_domains(cert_id)
+        cert, domains, _, _ = aliyun.replace_cert_for_all_matching_live_domains(cert_id)
+        replaced_domains.extend(str(d.domain_name) for d in domains)
+    if verify and cert and not verify_domains(replaced_domains, str(cert.cert), verify_deadline):
+        raise click.ClickException(f"not all replaced domains are serving certificate {cert_id}")
 
 
 @cli.command()
@@ -268,6 +382,12 @@ def replace_cert(aliyun: Aliyun, cert_id: int, cdn: bool, live: bool) -> None:
 @click.option("--cdn", is_flag=True, help="replace certificates of CDN domains")
 @click.option("--live", is_flag=True, help="replace certificates of live domains")
 @click.option("--delete-old-cert", is_flag=True, help="delete old certificate after deployment")
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="verify replaced domains are serving the new certificate over TLS, old certificate is kept if not",
+)
+@click.option("--verify-deadline", default=300, type=int, help="seconds to wait for domains to serve the certificate")
 @pass_aliyun
 def certbot_deploy_hook(
     aliyun: Aliyun,
@@ -276,6 +396,8 @@ def certbot_deploy_hook(
     cdn: bool,
     live: bool,
     delete_old_cert: bool,
+    verify: bool,
+    verify_deadline: int,
 ) -> None:
     """
     deploy hook for certbot
@@ -295,23 +417,42 @@ def certbot_deploy_hook(
         raise click.ClickException(f"failed to upload certificate for <{' '.join(d for d in renewed_domains)}>")
     log.info(f"certificate for <{' '.join(d for d in renewed_domains)}> uploaded, id: <{cert.id}>")
     cert_id_to_delete = set()
+    replaced_domains = []
     has_error = False
     if cdn:
-        _, _, old_cert_ids, errors = aliyun.replace_cert_for_all_matching_cdn_domains(cert.id)
+        _, domains, old_cert_ids, errors = aliyun.replace_cert_for_all_matching_cdn_domains(cert.id)
         cert_id_to_delete.update(old_cert_ids)
+        replaced_domains.extend(str(d.domain_name) for d in domains)
         if errors:
             has_error = True
     if live:
-        _, _, old_cert_ids, errors = aliyun.replace_cert_for_all_matching_live_domains(cert.id)
+        _, domains, old_cert_ids, errors = aliyun.replace_cert_for_all_matching_live_domains(cert.id)
         cert_id_to_delete.update(old_cert_ids)
+        replaced_domains.extend(str(d.domain_name) for d in domains)
         if errors:
             has_error = True
+    if verify and not verify_domains(replaced_domains, full_chain, verify_deadline):
+        log.warning("keep old certificates as not all replaced domains are serving the new certificate")
+        has_error = True
     if not has_error and delete_old_cert:
         for cert_id in cert_id_to_delete:
             aliyun.delete_cert(cert_id)
             log.info(f"deleted old certificate <{cert_id}>")
 
 
+def verify_domains(domains: List[str], cert_pem: str, deadline: int, jsonl: bool = False) -> bool:
+    if not domains:
+        return True
+    results = verify_served_cert(domains, cert_fingerprint(cert_pem), deadline=deadline)
+    for d, ok in results.items():
+        if jsonl:
+            error = None if ok else "not serving the certificate"
+            click.echo(json.dumps({"stage": "verify", "domain": d, "ok": ok, "error": error}))
+        else:
+            cprint(f"domain [bold green]{d}[/] verified" if ok else f"domain [bold red]{d}[/] not verified")
+    return all(results.values())
+
+
 def calc_left_days(dts: str) -> int:
     if not dts:
         return -1
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import ssl
+import asyncio
+import hashlib
+from typing import Dict, Iterable
+
+import logging
+
+log = logging.getLogger(__name__)
+
+PEM_BEGIN = "-----BEGIN CERTIFICATE-----"
+PEM_END = "-----END CERTIFICATE-----"
+# label of the name used to probe wildcard domains, which can not be connected directly
+WILDCARD_PROBE_LABEL = "aliyun-cert-verify"
+
+
+def cert_fingerprint(pem: str) -> str:
+    """
+    sha256 fingerprint of the leaf (first) certificate in a PEM chain
+    """
+    start = pem.find(PEM_BEGIN)
+    end = pem.find(PEM_END, start)
+    if start < 0 or end < 0:
+        raise Exception("Invalid PEM certificate")
+    return hashlib.sha256(ssl.PEM_cert_to_DER_cert(pem[start : end + len(PEM_END)])).hexdigest()
+
+
+def probe_name(domain: str) -> str:
+    """
+    concrete name to connect to for `domain`, wildcard domains like `*.example.com`
+    or `.example.com` are probed with a generated label under them
+    """
+    if domain.startswith("*."):
+        return f"{WILDCARD_PROBE_LABEL}.{domain[2:]}"
+    if domain.startswith("."):
+        return f"{WILDCARD_PROBE_LABEL}{domain}"
+    return domain
+
+
+async def _resolvable(name: str, port: int, timeout: float) -> bool:
+    try:
+        await asyncio.wait_for(asyncio.get_running_loop().getaddrinfo(name, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    return True
+
+
+async def fetch_served_fingerprint(
+    domain: str, port: int = 443, address: str | None = None, timeout: float = 10.0
+) -> str:
+    """
+    connect to `address` (the domain itself by default) with SNI `domain` and
+    return the sha256 fingerprint of the served leaf certificate
+    """
+    ctx = ssl.create_default_context()
+    # the served certificate is compared by fingerprint, it may be expired or not trusted yet
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    _, writer = await asyncio.wait_for(
+        asyncio.open_connection(address or domain, port, ssl=ctx, server_hostname=domain),
+        timeout,
+    )
+    try:
+        der = writer.get_extra_info("ssl_object").getpeercert(binary_form=True)
+    finally:
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), timeout)
+        except (OSError, asyncio.TimeoutError):
+            pass
+    return hashlib.sha256(der).hexdigest()
+
+
+async def _wait_for_cert(
+    domain: str,
+    fingerprint: str,
+    deadline: float,
+    semaphore: asyncio.Semaphore,
+    port: int,
+    address: str | None,
+    timeout: float,
+    interval: float,
+) -> bool:
+    loop = asyncio.get_running_loop()
+    while True:
+        async with semaphore:
+            try:
+                served = await fetch_served_fingerprint(domain, port, address, timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                log.debug(f"failed to fetch certificate of <{domain}>: {e!r}")
+                served = None
+        if served == fingerprint:
+            log.info(f"domain <{domain}> is serving the new certificate")
+            return True
+        if loop.time() + interval >= deadline:
+            log.warning(f"domain <{domain}> is not serving the new certificate, last seen: <{served}>")
+            return False
+        await asyncio.sleep(interval)
+
+
+async def _verify_served_cert(
+    domains: Iterable[str],
+    fingerprint: str,
+    deadline: float,
+    interval: float,
+    timeout: float,
+    concurrency: int,
+    port: int,
+    address: str | None,
+) -> Dict[str, bool]:
+    semaphore = asyncio.Semaphore(concurrency)
+    deadline_at = asyncio.get_running_loop().time() + deadline
+    domains = list(dict.fromkeys(domains))
+
+    async def verify(domain: str) -> bool:
+        name = probe_name(domain)
+        if name != domain:
+            if not address and not await _resolvable(name, port, timeout):
+                log.warning(f"can not verify wildcard domain <{domain}>, <{name}> does not resolve")
+                return False
+            log.info(f"verify wildcard domain <{domain}> with <{name}>")
+        return await _wait_for_cert(name, fingerprint, deadline_at, semaphore, port, address, timeout, interval)
+
+    results = await asyncio.gather(*(verify(d) for d in domains))
+    return dict(zip(domains, results))
+
+
+def verify_served_cert(
+    domains: Iterable[str],
+    fingerprint: str,
+    deadline: float = 300,
+    interval: float = 10,
+    timeout: float = 10,
+    concurrency: int = 50,
+    port: int = 443,
+    address: str | None = None,
+) -> Dict[str, bool]:
+    """
+    poll domains over TLS until all of them serve the certificate of `fingerprint`
+    or `deadline` seconds passed, return whether each domain converged,
+    wildcard domains are verified through `probe_name`
+    """
+    fingerprint = fingerprint.replace(":", "").lower()
+    return asyncio.run(
+        _verify_served_cert(domains, fingerprint, deadline, interval, timeout, concurrency, port, address)
+    )
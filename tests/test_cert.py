@@ -0,0 +1,173 @@
+from types import SimpleNamespace
+
+from alibabacloud_cdn20180510 import models as cdn_20180510_models
+
+from aliyun_cert.cert import Aliyun
+
+
+class FakeCdnClient:
+    def __init__(self, domains):
+        # domain name -> (gmt_modified, ssl_protocol)
+        self.domains = domains
+        self.cert_info_calls = []
+        self.set_calls = []
+        self.list_calls = 0
+
+    def describe_user_domains(self, request):
+        self.list_calls += 1
+        page_data = [
+            SimpleNamespace(domain_name=name, gmt_modified=gmt_modified, ssl_protocol=ssl_protocol)
+            for name, (gmt_modified, ssl_protocol) in self.domains.items()
+        ]
+        start = (request.page_number - 1) * request.page_size
+        return SimpleNamespace(
+            body=SimpleNamespace(
+                domains=SimpleNamespace(page_data=page_data[start : start + request.page_size]),
+                total_count=len(page_data),
+            )
+        )
+
+    def describe_domain_certificate_info(self, request):
+        self.cert_info_calls.append(request.domain_name)
+        cert_info = cdn_20180510_models.DescribeDomainCertificateInfoResponseBodyCertInfosCertInfo(
+            cert_id="1", cert_name=f"cert-{request.domain_name}", domain_name=request.domain_name
+        )
+        return SimpleNamespace(body=SimpleNamespace(cert_infos=SimpleNamespace(cert_info=[cert_info])))
+
+    def set_cdn_domain_sslcertificate(self, request):
+        if request.domain_name.startswith("fail"):
+            raise Exception(f"failed to set {request.domain_name}")
+        self.set_calls.append(request.domain_name)
+
+
+class FakeLiveClient:
+    def __init__(self, domains):
+        self.domains = domains
+        self.set_calls = []
+
+    def describe_live_user_domains(self, request):
+        page_data = [SimpleNamespace(domain_name=d) for d in self.domains]
+        start = (request.page_number - 1) * request.page_size
+        return SimpleNamespace(
+            body=SimpleNamespace(
+                domains=SimpleNamespace(page_data=page_data[start : start + request.page_size]),
+                total_count=len(page_data),
+            )
+        )
+
+    def set_live_domain_certificate(self, request):
+        if request.domain_name.startswith("fail"):
+            raise Exception(f"failed to set {request.domain_name}")
+        self.set_calls.append((request.domain_name, request.cert_name))
+
+
+def make_aliyun(tmp_path, domains):
+    aliyun = Aliyun("id", "secret", str(tmp_path / "snapshot.json"))
+    aliyun._cdn_client = FakeCdnClient(domains)
+    aliyun.get_cert_by_id = lambda cert_id: SimpleNamespace(id=cert_id, name=f"cert-{cert_id}")
+    return aliyun
+
+
+def scan(aliyun):
+    return {d.domain_name: [c.cert_name for c in certs] for d, certs in aliyun.iter_cdn_domains()}
+
+
+def test_unchanged_domains_are_served_from_snapshot(tmp_path):
+    domains = {f"d{i}.example.com": ("2024-01-01T00:00Z", "on") for i in range(1000)}
+    aliyun = make_aliyun(tmp_path, domains)
+    first = scan(aliyun)
+    assert len(aliyun._cdn_client.cert_info_calls) == 1000
+
+    aliyun._cdn_client.cert_info_calls.clear()
+    aliyun._cdn_client.list_calls = 0
+    domains["d1.example.com"] = ("2024-01-02T00:00Z", "on")
+    domains["new.example.com"] = ("2024-01-02T00:00Z", "on")
+    second = scan(aliyun)
+    assert sorted(aliyun._cdn_client.cert_info_calls) == ["d1.example.com", "new.example.com"]
+    assert aliyun._cdn_client.list_calls == 3
+    assert second == {**first, "new.example.com": ["cert-new.example.com"]}
+
+
+def test_ssl_protocol_flip_refetches(tmp_path):
+    domains = {"a.example.com": ("2024-01-01T00:00Z", "on")}
+    aliyun = make_aliyun(tmp_path, domains)
+    scan(aliyun)
+    domains["a.example.com"] = ("2024-01-01T00:00Z", "off")
+    assert scan(aliyun) == {}
+    domains["a.example.com"] = ("2024-01-01T00:00Z", "on")
+    aliyun._cdn_client.cert_info_calls.clear()
+    scan(aliyun)
+    assert aliyun._cdn_client.cert_info_calls == ["a.example.com"]
+
+
+def test_missing_gmt_modified_is_always_fetched(tmp_path):
+    aliyun = make_aliyun(tmp_path, {"a.example.com": (None, "on")})
+    scan(aliyun)
+    scan(aliyun)
+    assert aliyun._cdn_client.cert_info_calls == ["a.example.com", "a.example.com"]
+
+
+def test_set_cert_drops_domain_from_snapshot(tmp_path):
+    domains = {"a.example.com": ("2024-01-01T00:00Z", "on"), "b.example.com": ("2024-01-01T00:00Z", "on")}
+    aliyun = make_aliyun(tmp_path, domains)
+    scan(aliyun)
+    aliyun.set_cert_for_cdn_domain(2, "a.example.com")
+    _, results = aliyun.set_cert_for_cdn_domains(2, ["b.example.com"])
+    assert list(results) == [("b.example.com", None)]
+
+    aliyun._cdn_client.cert_info_calls.clear()
+    scan(aliyun)
+    assert sorted(aliyun._cdn_client.cert_info_calls) == ["a.example.com", "b.example.com"]
+
+
+def test_corrupt_snapshot_is_ignored(tmp_path):
+    (tmp_path / "snapshot.json").write_text("{not json")
+    aliyun = make_aliyun(tmp_path, {"a.example.com": ("2024-01-01T00:00Z", "on")})
+    assert scan(aliyun) == {"a.example.com": ["cert-a.example.com"]}
+    aliyun._cdn_client.cert_info_calls.clear()
+    scan(aliyun)
+    assert aliyun._cdn_client.cert_info_calls == []
+
+
+def test_unwritable_snapshot_is_ignored(tmp_path):
+    (tmp_path / "file").write_text("")
+    aliyun = make_aliyun(tmp_path, {"a.example.com": ("2024-01-01T00:00Z", "on")})
+    aliyun._cdn_snapshot_file = str(tmp_path / "file" / "snapshot.json")
+    assert scan(aliyun) == {"a.example.com": ["cert-a.example.com"]}
+    cert, d = aliyun.set_cert_for_cdn_domain(2, "a.example.com")
+    assert d.domain_name == "a.example.com"
+    assert aliyun._cdn_client.set_calls == ["a.example.com"]
+
+
+def test_set_cert_for_cdn_domains_reports_each_domain(tmp_path):
+    domains = {f"d{i}.example.com": ("2024-01-01T00:00Z", "on") for i in range(20)}
+    domains["fail.example.com"] = ("2024-01-01T00:00Z", "on")
+    aliyun = make_aliyun(tmp_path, domains)
+    scan(aliyun)
+    cert, results = aliyun.set_cert_for_cdn_domains(2, [*domains, "unknown.example.com"], concurrency=4)
+    assert cert.name == "cert-2"
+    errors = {d: str(e) if e else None for d, e in results}
+    assert errors == {
+        **{d: None for d in domains},
+        "fail.example.com": "failed to set fail.example.com",
+        "unknown.example.com": "CDN domain unknown.example.com not found",
+    }
+    assert sorted(aliyun._cdn_client.set_calls) == sorted(d for d in domains if d != "fail.example.com")
+
+    # only domains actually set are refreshed on the next scan
+    aliyun._cdn_client.cert_info_calls.clear()
+    scan(aliyun)
+    assert sorted(aliyun._cdn_client.cert_info_calls) == sorted(d for d in domains if d != "fail.example.com")
+
+
+def test_set_cert_for_live_domains_reports_each_domain(tmp_path):
+    aliyun = make_aliyun(tmp_path, {})
+    aliyun._live_client = FakeLiveClient(["a.example.com", "fail.example.com"])
+    _, results = aliyun.set_cert_for_live_domains(2, ["a.example.com", "fail.example.com", "unknown.example.com"])
+    errors = {d: str(e) if e else None for d, e in results}
+    assert errors == {
+        "a.example.com": None,
+        "fail.example.com": "failed to set fail.example.com",
+        "unknown.example.com": "live domain unknown.example.com not found",
+    }
+    assert aliyun._live_client.set_calls == [("a.example.com", "cert-2")]
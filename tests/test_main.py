@@ -0,0 +1,171 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import rich_click as click
+from click.testing import CliRunner
+
+from aliyun_cert import main
+from aliyun_cert.cert import Aliyun
+
+
+class FakeAliyun(Aliyun):
+    def __init__(self, *args, **kwargs):
+        self.known_domains = {"a.example.com", "b.example.com"}
+
+    def set_cert_for_cdn_domains(self, cert_id, domain_names, concurrency=10):
+        def iter_results():
+            for d in domain_names:
+                yield d, None if d in self.known_domains else Exception(f"CDN domain {d} not found")
+
+        return SimpleNamespace(id=cert_id, cert=""), iter_results()
+
+
+@pytest.fixture
+def run(monkeypatch):
+    monkeypatch.setattr(main, "Aliyun", FakeAliyun)
+    stream = main.sh.stream
+
+    def run(args, domains, **kwargs):
+        result = CliRunner(mix_stderr=False).invoke(
+            main.cli,
+            ["--access-key-id", "id", "--access-key-secret", "secret", "set-cert", "--cert-id", "1", *args],
+            input=domains,
+            **kwargs,
+        )
+        main.sh.setStream(stream)
+        return result
+
+    return run
+
+
+def test_set_cert_from_domain_file(run):
+    result = run(
+        ["--domain-file", "-", "--service", "cdn", "--output", "jsonl"],
+        "a.example.com\n  # comment\n\n b.example.com\na.example.com\n",
+    )
+    assert result.exit_code == 0, result.stderr
+    assert [json.loads(l) for l in result.stdout.splitlines()] == [
+        {"stage": "set", "domain": "a.example.com", "ok": True, "error": None},
+        {"stage": "set", "domain": "b.example.com", "ok": True, "error": None},
+    ]
+    assert "set for 2 of 2 cdn domains" in result.stderr
+
+
+def test_set_cert_from_domain_file_partial_failure(run):
+    result = run(
+        ["--domain-file", "-", "--service", "cdn", "--output", "jsonl"],
+        "a.example.com\nc.example.com\n",
+        standalone_mode=False,
+    )
+    assert isinstance(result.exception, click.ClickException)
+    assert str(result.exception) == "cert 1 set for 1 of 2 cdn domains, failed: c.example.com"
+    assert [json.loads(l)["ok"] for l in result.stdout.splitlines()] == [True, False]
+
+
+def test_set_cert_verify_results_share_schema(run, monkeypatch):
+    monkeypatch.setattr(main, "cert_fingerprint", lambda pem: "fingerprint")
+    monkeypatch.setattr(
+        main, "verify_served_cert", lambda domains, fingerprint, deadline: {d: d == "a.example.com" for d in domains}
+    )
+    result = run(
+        ["--domain-file", "-", "--service", "cdn", "--output", "jsonl", "--verify"],
+        "a.example.com\nb.example.com\n",
+        standalone_mode=False,
+    )
+    assert str(result.exception) == "cert 1 set for 2 of 2 cdn domains, not all domains are serving certificate 1"
+    records = [json.loads(l) for l in result.stdout.splitlines()]
+    assert {tuple(r) for r in records} == {("stage", "domain", "ok", "error")}
+    assert [(r["stage"], r["domain"], r["ok"]) for r in records if r["stage"] == "verify"] == [
+        ("verify", "a.example.com", True),
+        ("verify", "b.example.com", False),
+    ]
+
+
+def test_set_cert_with_progress(run):
+    result = run(["--domain-file", "-", "--service", "cdn"], "a.example.com\nc.example.com\n")
+    assert result.exit_code == 1
+    assert "set for a.example.com" in result.stdout
+    assert "c.example.com failed: CDN domain c.example.com not found" in result.stdout
+
+
+def test_set_cert_rejects_empty_domain_file(run):
+    result = run(["--domain-file", "-", "--service", "cdn"], "\n  # comment\n")
+    assert result.exit_code == 2
+
+
+def test_set_cert_rejects_invalid_concurrency(run):
+    result = run(["--domain-file", "-", "--service", "cdn", "--concurrency", "0"], "a.example.com\n")
+    assert result.exit_code == 2
+
+
+def test_set_cert_rejects_bulk_options_with_domain(run):
+    for option in (["--concurrency", "5"], ["--output", "jsonl"]):
+        result = run(["--domain", "a.example.com", "--service", "cdn", *option], "")
+        assert result.exit_code == 2
+
+
+
+class FakeDeployAliyun(Aliyun):
+    deleted = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def upload_cert(self, domain_name, full_chain, private_key):
+        return SimpleNamespace(id=2)
+
+    def replace_cert_for_all_matching_cdn_domains(self, new_cert_id):
+        domains = [SimpleNamespace(domain_name="a.example.com"), SimpleNamespace(domain_name="*.example.com")]
+        return SimpleNamespace(id=new_cert_id), domains, {1}, []
+
+    def delete_cert(self, cert_id):
+        self.deleted.append(cert_id)
+
+
+@pytest.fixture
+def deploy(monkeypatch, tmp_path):
+    (tmp_path / "fullchain.pem").write_text("fullchain")
+    (tmp_path / "privkey.pem").write_text("privkey")
+    monkeypatch.setattr(main, "Aliyun", FakeDeployAliyun)
+    monkeypatch.setattr(FakeDeployAliyun, "deleted", [])
+    monkeypatch.setattr(main, "cert_fingerprint", lambda pem: "fingerprint")
+
+    def deploy(verified):
+        verified_domains = []
+
+        def verify_served_cert(domains, fingerprint, deadline):
+            verified_domains.extend(domains)
+            return {d: verified for d in domains}
+
+        monkeypatch.setattr(main, "verify_served_cert", verify_served_cert)
+        result = CliRunner(mix_stderr=False).invoke(
+            main.cli,
+            [
+                "--access-key-id",
+                "id",
+                "--access-key-secret",
+                "secret",
+                "certbot-deploy-hook",
+                "--cert-path",
+                str(tmp_path),
+                "--renewed_domains",
+                "example.com *.example.com",
+                "--cdn",
+                "--delete-old-cert",
+                "--verify",
+            ],
+        )
+        assert result.exit_code == 0, result.stderr
+        assert verified_domains == ["a.example.com", "*.example.com"]
+        return FakeDeployAliyun.deleted
+
+    return deploy
+
+
+def test_deploy_hook_keeps_old_cert_when_not_verified(deploy):
+    assert deploy(verified=False) == []
+
+
+def test_deploy_hook_deletes_old_cert_when_verified(deploy):
+    assert deploy(verified=True) == [1]
@@ -0,0 +1,137 @@
+import ssl
+import socket
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from aliyun_cert.verify import cert_fingerprint, probe_name, verify_served_cert
+
+
+def make_cert(tmp_path, name):
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cert_file = tmp_path / f"{name}.pem"
+    key_file = tmp_path / f"{name}.key"
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return str(cert_file), str(key_file)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def served_cert(tmp_path):
+    """
+    serve a self-signed certificate on 127.0.0.1, yield (port, certificate PEM)
+    """
+    cert_file, key_file = make_cert(tmp_path, "served.example.com")
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert_file, key_file)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    async def handle(reader, writer):
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=ctx)
+        serve.port = server.sockets[0].getsockname()[1]
+        started.set()
+        async with server:
+            await server.serve_forever()
+
+    task = loop.create_task(serve())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    started.wait(5)
+    with open(cert_file) as f:
+        yield serve.port, f.read()
+    task.add_done_callback(lambda _: loop.stop())
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+    loop.close()
+
+
+def verify(domains, fingerprint, port, deadline=1):
+    return verify_served_cert(
+        domains, fingerprint, deadline=deadline, interval=0.2, timeout=1, port=port, address="127.0.0.1"
+    )
+
+
+def test_cert_fingerprint_uses_leaf(tmp_path):
+    leaf, _ = make_cert(tmp_path, "leaf.example.com")
+    other, _ = make_cert(tmp_path, "other.example.com")
+    with open(leaf) as f1, open(other) as f2:
+        leaf_pem = f1.read()
+        assert cert_fingerprint("\n" + leaf_pem + f2.read()) == cert_fingerprint(leaf_pem)
+
+
+def test_matching_cert_is_verified(served_cert):
+    port, pem = served_cert
+    assert verify(["a.example.com", "b.example.com"], cert_fingerprint(pem), port) == {
+        "a.example.com": True,
+        "b.example.com": True,
+    }
+
+
+def test_other_cert_is_not_verified(served_cert, tmp_path):
+    port, _ = served_cert
+    other, _ = make_cert(tmp_path, "other.example.com")
+    with open(other) as f:
+        assert verify(["a.example.com"], cert_fingerprint(f.read()), port) == {"a.example.com": False}
+
+
+def test_connection_refused_is_not_verified(tmp_path):
+    cert_file, _ = make_cert(tmp_path, "a.example.com")
+    with open(cert_file) as f:
+        assert verify(["a.example.com"], cert_fingerprint(f.read()), free_port()) == {"a.example.com": False}
+
+
+def test_probe_name():
+    assert probe_name("a.example.com") == "a.example.com"
+    assert probe_name("*.example.com") == "aliyun-cert-verify.example.com"
+    assert probe_name(".example.com") == "aliyun-cert-verify.example.com"
+
+
+def test_wildcard_domains_are_verified_with_probe_name(served_cert):
+    port, pem = served_cert
+    assert verify(["*.example.com", ".example.com", "a.example.com"], cert_fingerprint(pem), port) == {
+        "*.example.com": True,
+        ".example.com": True,
+        "a.example.com": True,
+    }
+
+
+def test_unresolvable_wildcard_domain_is_not_verified(tmp_path):
+    cert_file, _ = make_cert(tmp_path, "a.example.com")
+    with open(cert_file) as f:
+        assert verify_served_cert(["*.example.invalid"], cert_fingerprint(f.read()), deadline=1, timeout=1) == {
+            "*.example.invalid": False
+        }